@@ -0,0 +1,231 @@
+import time
+import logging
+import threading
+import numpy as np
+
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+OPS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class AlertRule:
+    """A single alert condition loaded from the [[alerts.rules]] config tables.
+
+    kind = "threshold": field <op> value, e.g. FET_T > 85
+    kind = "peer":      field <= value while at least min_peers other units on
+                        the same gateway report field > peer_value
+    kind = "change":    field differs from the previous value seen for the unit
+    """
+
+    KINDS = ("threshold", "peer", "change")
+
+    def __init__(
+        self,
+        field: str,
+        kind: str = "threshold",
+        op: str = ">",
+        value: float = 0.0,
+        peer_value: float = 1.0,
+        min_peers: int = 1,
+        hold: int = None,
+        name: str = "",
+    ):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown alert kind '{kind}' for {field}")
+        if kind == "threshold" and op not in OPS:
+            raise ValueError(f"Unknown alert operator '{op}' for {field}")
+
+        self.field = field
+        self.kind = kind
+        self.op = op
+        self.value = value
+        self.peer_value = peer_value
+        self.min_peers = min_peers
+        self.hold = hold
+        self.name = name or self.describe()
+
+    def describe(self):
+        if self.kind == "peer":
+            return f"{self.field} <= {self.value} while peers produce"
+        if self.kind == "change":
+            return f"{self.field} changed"
+        return f"{self.field} {self.op} {self.value}"
+
+    def evaluate(self, values, peers=None, previous=None):
+        """Return a boolean mask over the batch, one entry per unit."""
+        if self.kind == "threshold":
+            with np.errstate(invalid="ignore"):
+                return OPS[self.op](values, self.value)
+
+        if self.kind == "change":
+            return np.array([v != p for v, p in zip(values, previous)], dtype=bool)
+
+        # Units not counted as producing themselves are excluded from the peers
+        with np.errstate(invalid="ignore"):
+            producing = np.count_nonzero(peers > self.peer_value)
+            self_producing = values > self.peer_value
+            idle = values <= self.value
+        return idle & (producing - self_producing >= self.min_peers)
+
+
+class AlertEngine:
+    """Evaluates alert rules against each ingest batch of a gateway thread.
+
+    Rules are evaluated column-wise with numpy over every unit in the batch, a
+    rule has to hold for `debounce` consecutive batches before it fires, and
+    fired alerts are kept in `history` and optionally appended to a log file.
+    """
+
+    HISTORY = 1000
+
+    def __init__(self, rules=None, debounce=3, cooldown=60, path=None):
+        self.rules: list[AlertRule] = rules or []
+        self.debounce = debounce
+        self.cooldown = cooldown
+        self.path = path
+
+        self.history = deque(maxlen=self.HISTORY)
+        self.active: dict[str, dict[str, float]] = dict()
+        self.counts: dict[int, dict[str, int]] = dict()
+        self.previous: dict[int, dict[str, object]] = dict()
+        self.fired: dict[tuple[int, str], float] = dict()
+
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        section = config.get("alerts", {})
+        rules = [AlertRule(**rule) for rule in section.get("rules", [])]
+        return cls(
+            rules,
+            debounce=section.get("debounce", 3),
+            cooldown=section.get("cooldown", 60),
+            path=section.get("log"),
+        )
+
+    def evaluate(self, gateway, leaves, peers=()):
+        """Evaluate every rule against a batch and return newly fired alerts.
+
+        leaves are the units updated in this batch, peers the units on the
+        gateway that are still reporting. Returns a list of (gateway, mac, message) tuples.
+        """
+        if not self.rules or not leaves:
+            return []
+
+        macs = [leaf.mac for leaf in leaves]
+        columns: dict[str, np.ndarray] = dict()
+        alerts = list()
+        now = time.time()
+
+        with self.lock:
+            for i, rule in enumerate(self.rules):
+                if rule.kind == "change":
+                    # Fields like sl_status mix types, compare each unit's own value
+                    values = [getattr(l, rule.field, "") for l in leaves]
+                    previous = self.previous.setdefault(i, dict())
+                    last = [previous.get(m, v) for m, v in zip(macs, values)]
+                    mask = rule.evaluate(values, previous=last)
+                    previous.update(zip(macs, values))
+                else:
+                    if rule.field not in columns:
+                        columns[rule.field] = self._column(leaves, rule.field)
+                    values = columns[rule.field]
+                    others = self._column(peers, rule.field) if rule.kind == "peer" else None
+                    mask = rule.evaluate(values, peers=others)
+
+                alerts.extend(self._debounce(i, rule, gateway, macs, mask, now))
+
+        for alert in alerts:
+            self.record(*alert, now)
+
+        return alerts
+
+    def alerting(self, mac):
+        """Fields currently in alert for a unit."""
+        with self.lock:
+            return set(self.active.get(mac, ()))
+
+    def forget(self, macs):
+        """Drop all alert state of evicted units."""
+        with self.lock:
+            for mac in macs:
+                self.active.pop(mac, None)
+                for counts in self.counts.values():
+                    counts.pop(mac, None)
+                for previous in self.previous.values():
+                    previous.pop(mac, None)
+                for i in range(len(self.rules)):
+                    self.fired.pop((i, mac), None)
+
+    def record(self, gateway, mac, message, timestamp=None):
+        timestamp = timestamp or time.time()
+        self.history.append((timestamp, gateway, mac, message))
+        log.warning(f"Alert: {gateway} - {mac}: {message}")
+
+        if not self.path:
+            return
+
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+        try:
+            with open(self.path, "a") as f:
+                f.write(f"{stamp},{gateway},{mac},{message}\n")
+        except OSError as err:
+            log.info(f"Couldn't write alert log {self.path} error: {err}")
+
+    def _column(self, leaves, field):
+        return np.fromiter(
+            (to_float(getattr(l, field, None)) for l in leaves),
+            dtype=float,
+            count=len(leaves),
+        )
+
+    def _debounce(self, i, rule, gateway, macs, mask, now):
+        counts = self.counts.setdefault(i, dict())
+        hold = rule.hold or (1 if rule.kind == "change" else self.debounce)
+        hits = {macs[j] for j in np.flatnonzero(mask)}
+        batch = set(macs)
+
+        # Reset units that were counting but no longer match
+        for mac in [m for m in counts if m not in hits and m in batch]:
+            del counts[mac]
+            if rule.kind != "change":
+                self.active.get(mac, {}).pop(rule.field, None)
+
+        # Change alerts have no "cleared" state, they expire after the cooldown
+        if rule.kind == "change":
+            for mac in macs:
+                since = self.active.get(mac, {}).get(rule.field)
+                if since is not None and now - since > self.cooldown:
+                    del self.active[mac][rule.field]
+
+        alerts = list()
+        for mac in hits:
+            counts[mac] = counts.get(mac, 0) + 1
+            if counts[mac] < hold:
+                continue
+
+            self.active.setdefault(mac, dict()).setdefault(rule.field, now)
+
+            if now - self.fired.get((i, mac), 0) < self.cooldown:
+                continue
+            self.fired[(i, mac)] = now
+            alerts.append((gateway, mac, rule.name))
+
+        return alerts
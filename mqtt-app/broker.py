@@ -1,11 +1,15 @@
 import re
+import time
+import random
 import logging
 import socket
+import threading
 import paho.mqtt.client as mqtt
 
-from queue import Queue
+from queue import Queue, Empty
 
 from config import parse_args
+from profiler import profiler
 
 args = parse_args()
 config = args.config
@@ -16,40 +20,280 @@ logging.basicConfig(level=lvl, format="%(name)s [%(levelname)s]: %(message)s")
 
 
 class MQTT_Broker:
-    def __init__(self, host):
+    PORT = 1883
+    # Longest a client call from another thread waits for the network thread
+    TICK = 0.1
+
+    # Subscription modes: "telemetry" while a tab shows the gateway, "presence"
+    # only tracks which MACs are on the gateway without queueing any messages
+    MODES = ("off", "presence", "telemetry")
+
+    def __init__(self, host, name=""):
+        options = config.get("mqtt", {})
+        topics = config.get("subscriptions", {})
         self.host = host
-        self.client = mqtt.Client()
+        self.name = name or host
+        self.qos = options.get("qos", 0)
+        self.keepalive = options.get("keepalive", 60)
+        self.backoff_min = options.get("backoff_min", 1.0)
+        self.backoff_max = options.get("backoff_max", 60.0)
+        self.persistent = options.get("persistent_session", False)
+
+        # Fast and slow samples share a topic and are told apart by "type", so
+        # only narrow the filters when the firmware's subtopics are configured
+        self.telemetry = topics.get("telemetry", ["Yotta/+/+"])
+        self.fast_topics = topics.get("fast", [])
+        self.presence = topics.get("presence", ["Yotta/+/+"])
+        self.presence_interval = topics.get("presence_interval", 60)
+
+        # A persistent session needs a stable client id to be resumed
+        self.client_id = f"mqtt-app-{socket.gethostname()}-{self.name}"
+        self.client = mqtt.Client(
+            client_id=self.client_id if self.persistent else "",
+            clean_session=not self.persistent,
+        )
+        self.cleared = not self.persistent
 
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
 
         self.queue = Queue()
+        self.commands = Queue()
         self.available = True
 
+        self.state = "offline"
+        self.down = time.time()
+        self.offline = 0.0
+        self.attempts = 0
+        self.running = False
+        self.thread = None
+        self.wake = threading.Event()
+
+        self.mode = "presence"
+        self.fast: dict[str, int] = dict()
+        self.filters: dict[str, int] = dict()
+        self.seen: dict[str, float] = dict()
+        self.polled = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self.state == "connected"
+
+    @property
+    def downtime(self):
+        # Seconds since the connection was last lost, 0 while connected
+        return 0.0 if self.connected else time.time() - self.down
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        if self.state == "connected":
+            self.down = time.time()
+        if state == "connected":
+            self.offline = time.time() - self.down
+        self.state = state
+
     def on_connect(self, client, userdata, flags, rc):
         log.info(f"Broker: {self.host} connected with result code {str(rc)}")
-        client.subscribe("Yotta/#")
+        if rc != 0:
+            return
+
+        self.set_state("connected")
+        self.attempts = 0
+        if self.offline > 1:
+            log.info(f"Broker: {self.host} back online after {self.offline:.0f}s")
+
+        # A resumed persistent session keeps its subscriptions on the broker
+        if flags.get("session present"):
+            log.info(f"Broker: {self.host} resumed persistent session")
+        else:
+            self.filters = dict()
+        self.resubscribe()
 
     def on_disconnect(self, client, userdata, rc):
         log.info(f"Broker: {self.host} disconnected with result code {str(rc)}")
+        self.set_state("offline")
 
     def on_message(self, client, userdata, msg):
-        if re.match("Yotta/............/", msg.topic) is not None:
+        if re.match("Yotta/............/", msg.topic) is None:
+            return
+        if msg.topic.endswith("/cmd"):
+            return
+
+        # Every mode feeds the MAC location index, only telemetry is queued
+        with self.lock:
+            self.seen[msg.topic[6:18]] = time.time()
+        if self.mode == "telemetry":
             self.queue.put(msg)
 
+    def set_mode(self, mode):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown subscription mode '{mode}'")
+
+        log.info(f"Broker: {self.host} subscription mode {mode}")
+        self.mode = mode
+        if mode != "telemetry":
+            # Nobody reads the queue anymore
+            with self.queue.mutex:
+                self.queue.queue.clear()
+        self.call(self.resubscribe)
+
+    def add_fast(self, mac):
+        # Several plots can show the same unit, count them
+        self.fast[mac] = self.fast.get(mac, 0) + 1
+        if self.fast[mac] == 1:
+            self.call(self.resubscribe)
+        return self.fast[mac]
+
+    def remove_fast(self, mac):
+        """Release one user of mac's fast data, returning how many are left."""
+        count = self.fast.get(mac, 0) - 1
+        if count > 0:
+            self.fast[mac] = count
+            return count
+
+        self.fast.pop(mac, None)
+        self.call(self.resubscribe)
+        return 0
+
+    def wanted(self):
+        if self.mode == "telemetry":
+            topics = list(self.telemetry)
+            for mac in self.fast:
+                for topic in self.fast_topics:
+                    topic = topic.format(mac=mac)
+                    # Skip fast topics a telemetry filter already delivers
+                    if not any(mqtt.topic_matches_sub(t, topic) for t in topics):
+                        topics.append(topic)
+            return dict((topic, self.qos) for topic in topics)
+        if self.mode == "presence":
+            return dict((topic, 0) for topic in self.presence)
+        return dict()
+
+    def resubscribe(self):
+        # Only subscribe and unsubscribe the difference to the current filters
+        with self.lock:
+            if not self.connected:
+                return
+
+            wanted = self.wanted()
+            removed = [topic for topic in self.filters if topic not in wanted]
+            added = [
+                (topic, qos)
+                for topic, qos in wanted.items()
+                if self.filters.get(topic) != qos
+            ]
+
+            if removed:
+                self.client.unsubscribe(removed)
+            if added:
+                self.client.subscribe(added)
+            self.filters = wanted
+
+    def sightings(self):
+        """MACs seen since the last call with the time they were last seen."""
+        with self.lock:
+            seen, self.seen = self.seen, dict()
+        return seen
+
+    def poll(self):
+        # Presence mode asks the units to report in at a low rate
+        if self.mode != "presence" or not self.connected:
+            return
+        if time.time() - self.polled < self.presence_interval:
+            return
+
+        self.polled = time.time()
+        self.publish("Yotta/cmd", "getid")
+
     def start(self):
-        sock = socket.create_connection((self.host, 1883), timeout=3)
-        self.client.socket = sock
-        self.client.connect(self.host)
-        self.client.loop_start()
+        # The network thread owns connecting, so failed gateways keep retrying
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # The network thread disconnects once it leaves its loop
+        self.running = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join()
+
+    def reconnect(self):
+        # Skip the remaining backoff and retry right away
+        self.wake.set()
+
+    def run(self):
+        while self.running:
+            profiler.checkpoint(f"broker-{self.name}")
+            self.drain()
+
+            if self.state == "offline":
+                if self.attempts:
+                    delay = self.backoff()
+                    log.info(f"Broker: {self.host} retry in {delay:.1f}s")
+                    self.wake.wait(delay)
+                    self.wake.clear()
+                    if not self.running:
+                        break
+
+                self.attempts += 1
+                self.connect()
+                continue
 
-    def stop(self, name):
-        self.client.disconnect(name)
-        self.client.loop_stop()
+            rc = self.client.loop(timeout=self.TICK)
+            self.poll()
+            if rc != mqtt.MQTT_ERR_SUCCESS and self.state != "offline":
+                self.on_disconnect(self.client, None, rc)
+
+        self.client.disconnect()
+        profiler.finish(f"broker-{self.name}")
+
+    def call(self, func, *args):
+        # Without loop_start() paho writes to the socket from whichever thread
+        # calls it, so other threads hand their client calls to the network thread
+        if threading.current_thread() is self.thread:
+            func(*args)
+        else:
+            self.commands.put((func, args))
+
+    def drain(self):
+        while True:
+            try:
+                func, args = self.commands.get_nowait()
+            except Empty:
+                return
+            func(*args)
+
+    def connect(self):
+        self.set_state("connecting")
+        try:
+            if not self.cleared:
+                self.clear_session()
+            self.client.connect(self.host, self.PORT, keepalive=self.keepalive)
+        except Exception as err:
+            log.info(f"Broker: {self.host} couldn't connect, error: {err}")
+            self.set_state("offline")
+
+    def clear_session(self):
+        # The broker may still hold a previous run's subscriptions for our
+        # client id, which we can't list, so drop that session once per run
+        client = mqtt.Client(client_id=self.client_id, clean_session=True)
+        client.connect(self.host, self.PORT, keepalive=self.keepalive)
+        client.loop(timeout=1.0)
+        client.disconnect()
+        self.cleared = True
+        log.info(f"Broker: {self.host} cleared the previous persistent session")
+
+    def backoff(self):
+        # Exponential backoff with equal jitter so gateways don't retry in step
+        delay = min(self.backoff_max, self.backoff_min * 2 ** (self.attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
 
     def publish(self, topic: str = "Yotta/cmd", payload: str = "getid"):
-        self.client.publish(topic, payload)
+        self.call(self.client.publish, topic, payload)
 
     def get(self):
         if self.available:
@@ -58,3 +302,18 @@ class MQTT_Broker:
             self.available = True
 
         return msg
+
+    def get_batch(self, size: int = 500, timeout: float = 1.0) -> list:
+        # Block for the first message, then drain whatever else is queued
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except Empty:
+            return []
+
+        while len(batch) < size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+
+        return batch
@@ -0,0 +1,277 @@
+import os
+import csv
+import time
+import logging
+import zipfile
+import threading
+import numpy as np
+
+from pathlib import Path
+from datetime import datetime, timedelta
+
+from PyQt5.QtCore import pyqtSignal, QThread
+
+log = logging.getLogger(__name__)
+
+TEXT_FIELDS = {"gateway", "mac", "sl_status", "FW_CRC", "VERSION"}
+
+
+def leaf_row(leaf, fields):
+    return [leaf.last] + [getattr(leaf, name, "") for name in fields]
+
+
+class HistoryRecorder:
+    """Appends every ingest batch to one CSV file per day in `directory`.
+
+    A day file recorded with different fields is never appended to, rows go
+    to the next free "<day>.<part>.csv" file instead.
+    """
+
+    def __init__(self, directory, fields):
+        self.directory = Path(directory)
+        self.fields = fields
+        self.header = ["timestamp"] + fields
+
+        self.day = None
+        self.file = None
+        self.writer = None
+        self.lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config, fields):
+        section = config.get("history", {})
+        if not section.get("dir"):
+            return None
+        return cls(section["dir"], fields)
+
+    def path(self, day, part=0):
+        return self.directory / (f"{day}.csv" if not part else f"{day}.{part}.csv")
+
+    def record(self, leaves):
+        if not leaves:
+            return
+
+        with self.lock:
+            self._rotate()
+            self.writer.writerows(leaf_row(leaf, self.fields) for leaf in leaves)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def _rotate(self):
+        day = time.strftime("%Y-%m-%d", time.localtime())
+        if day == self.day:
+            return
+
+        if self.file:
+            self.file.close()
+
+        part = 0
+        header = read_header(self.path(day))
+        while header is not None and header != self.header:
+            part += 1
+            header = read_header(self.path(day, part))
+
+        self.file = open(self.path(day, part), "a", newline="")
+        self.writer = csv.writer(self.file)
+        if header is None:
+            self.writer.writerow(self.header)
+        self.day = day
+
+
+def read_header(path):
+    """Header row of a history file, None if it doesn't exist or is empty."""
+    if not path.exists():
+        return None
+    with open(path, newline="") as f:
+        return next(csv.reader(f), None)
+
+
+def day_paths(directory, day):
+    # "<day>.csv" first, then the parts in the order they were started
+    parts = sorted(directory.glob(f"{day}.*.csv"), key=lambda p: int(p.stem.split(".")[1]))
+    return [path for path in [directory / f"{day}.csv"] + parts if path.exists()]
+
+
+### Sources ###
+# Each source is a generator of (rows, progress) with at most `chunk` rows and
+# progress in percent, so exports never hold more than one chunk in memory.
+
+
+def snapshot_rows(leaves, fields, chunk=1000):
+    leaves = list(leaves)
+    for start in range(0, len(leaves), chunk):
+        rows = [leaf_row(leaf, fields) for leaf in leaves[start : start + chunk]]
+        yield rows, int(100 * (start + len(rows)) / len(leaves))
+
+
+def history_rows(directory, fields, macs, start, end, chunk=10000):
+    """Rows of the daily history files between the start and end timestamps.
+
+    Rows are mapped through the header of their own file onto
+    ["timestamp"] + fields, fields a file doesn't have are left empty.
+    Malformed rows, e.g. a line cut short by a crash, are skipped.
+    """
+    directory = Path(directory)
+    macs = set(macs)
+    fields = ["timestamp"] + list(fields)
+
+    day = datetime.fromtimestamp(start).date()
+    last = datetime.fromtimestamp(end).date()
+    paths = list()
+    while day <= last:
+        paths.extend(day_paths(directory, day))
+        day += timedelta(days=1)
+
+    total = sum(os.path.getsize(path) for path in paths) or 1
+    done = 0
+
+    rows = list()
+    for path in paths:
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None or "mac" not in header:
+                log.info(f"Skipping history file {path} without a header")
+                continue
+            mac_index = header.index("mac")
+            columns = [header.index(name) if name in header else None for name in fields]
+            skipped = 0
+
+            for row in reader:
+                # Approximate bytes read, tell() is unavailable while iterating
+                done += sum(map(len, row)) + len(row)
+                if len(row) != len(header):
+                    skipped += 1
+                    continue
+                try:
+                    stamp = float(row[0])
+                except ValueError:
+                    skipped += 1
+                    continue
+                if macs and row[mac_index] not in macs:
+                    continue
+                if not start <= stamp <= end:
+                    continue
+
+                rows.append(["" if i is None else row[i] for i in columns])
+                if len(rows) >= chunk:
+                    yield rows, min(int(100 * done / total), 99)
+                    rows = list()
+
+            if skipped:
+                log.info(f"Skipped {skipped} malformed rows in {path}")
+
+    if rows:
+        yield rows, 100
+
+
+### Writers ###
+class CsvWriter:
+    def __init__(self, path, header):
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(header)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ColumnarWriter:
+    """Chunked columnar export as a compressed .npz archive.
+
+    Every chunk is stored as one .npy array per column named
+    "<column>/<chunk>", use load_columns() to concatenate them again.
+    """
+
+    def __init__(self, path, header):
+        self.header = header
+        self.chunk = 0
+        self.zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, rows):
+        for i, name in enumerate(self.header):
+            values = [row[i] for row in rows]
+            if name in TEXT_FIELDS:
+                array = np.array(values, dtype=str)
+            else:
+                array = np.array([self._float(v) for v in values], dtype=np.float64)
+
+            with self.zip.open(f"{name}/{self.chunk:06d}.npy", "w") as f:
+                np.lib.format.write_array(f, array, allow_pickle=False)
+
+        self.chunk += 1
+
+    def close(self):
+        self.zip.close()
+
+    def _float(self, value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+
+
+def load_columns(path):
+    """Read a ColumnarWriter archive into a dict of column arrays."""
+    chunks: dict[str, list] = dict()
+    with np.load(path) as data:
+        for name in sorted(data.files):
+            column = name.split("/")[0]
+            chunks.setdefault(column, list()).append(data[name])
+
+    return {column: np.concatenate(arrays) for column, arrays in chunks.items()}
+
+
+WRITERS = {".csv": CsvWriter, ".npz": ColumnarWriter}
+
+
+class ExportThread(QThread):
+    progress_signal = pyqtSignal(int)
+    done_signal = pyqtSignal(str)
+
+    def __init__(self, path, header, source):
+        super().__init__()
+
+        self.path = path
+        self.header = header
+        self.source = source
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        suffix = Path(self.path).suffix.lower()
+        if suffix not in WRITERS:
+            self.done_signal.emit(f"Unsupported export format '{suffix}'")
+            return
+
+        try:
+            writer = WRITERS[suffix](self.path, self.header)
+            try:
+                for rows, progress in self.source:
+                    if self.cancelled:
+                        break
+                    writer.write(rows)
+                    self.progress_signal.emit(progress)
+            finally:
+                writer.close()
+        except Exception as err:
+            self.done_signal.emit(f"Export to {self.path} failed: {err}")
+            return
+
+        if self.cancelled:
+            self.done_signal.emit(f"Export to {self.path} cancelled")
+        else:
+            self.progress_signal.emit(100)
+            self.done_signal.emit(f"Exported to {self.path}")
@@ -0,0 +1,91 @@
+import threading
+
+from collections import OrderedDict
+
+
+class LeafRegistry:
+    """Tracks which gateway thread owns each unit.
+
+    Units evicted from a gateway are kept (up to `departed` of them) so their
+    state can be handed over to whichever gateway they show up on next. A unit
+    that appears on a second gateway while still owned by the first is handed
+    over directly and queued for removal from the first.
+    """
+
+    def __init__(self, departed=1000):
+        self.size = departed
+        self.owners: dict[str, tuple] = dict()
+        self.departed: OrderedDict = OrderedDict()
+        self.pending: dict[str, set[str]] = dict()
+        self.presence: dict[str, tuple] = dict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("eviction", {}).get("departed", 1000))
+
+    def claim(self, mac, gateway):
+        """Register mac on gateway, returning its previous SolarLEAF if known."""
+        with self.lock:
+            owner, leaf = self.owners.get(mac, (None, None))
+            if owner is not None and owner != gateway:
+                self.pending.setdefault(owner, set()).add(mac)
+            elif owner is None:
+                leaf = self.departed.pop(mac, None)
+            return leaf
+
+    def register(self, mac, gateway, leaf):
+        with self.lock:
+            self.owners[mac] = (gateway, leaf)
+
+    def release(self, gateway, leaves):
+        """Move evicted leaves of gateway into the departed store."""
+        with self.lock:
+            for leaf in leaves:
+                owner, _ = self.owners.get(leaf.mac, (None, None))
+                if owner == gateway:
+                    del self.owners[leaf.mac]
+                self.departed[leaf.mac] = leaf
+                self.departed.move_to_end(leaf.mac)
+
+            while len(self.departed) > self.size:
+                self.departed.popitem(last=False)
+
+    def handoffs(self, gateway):
+        """Macs another gateway took over since the last call."""
+        with self.lock:
+            return self.pending.pop(gateway, set())
+
+    def sighted(self, gateway, seen):
+        """Record MACs a broker saw, whether or not a tab shows its gateway."""
+        with self.lock:
+            for mac, when in seen.items():
+                if when >= self.presence.get(mac, (None, 0.0))[1]:
+                    self.presence[mac] = (gateway, when)
+
+    def last_seen(self, mac):
+        """(gateway, time) of the most recent sighting of mac, or None."""
+        with self.lock:
+            sightings = list()
+            if mac in self.owners:
+                gateway, leaf = self.owners[mac]
+                sightings.append((leaf.last, gateway))
+            if mac in self.presence:
+                gateway, when = self.presence[mac]
+                sightings.append((when, gateway))
+            if mac in self.departed:
+                leaf = self.departed[mac]
+                sightings.append((leaf.last, leaf.gateway))
+
+        if not sightings:
+            return None
+        when, gateway = max(sightings)
+        return gateway, when
+
+    def location(self, mac):
+        seen = self.last_seen(mac)
+        return seen[0] if seen else None
+
+    def leaves(self):
+        with self.lock:
+            return [leaf for _, leaf in self.owners.values()]
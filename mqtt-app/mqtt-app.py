@@ -1,22 +1,28 @@
 import re
 import sys
 import time
-from datetime import datetime
 import json
 import logging
-import numpy as np
+from pathlib import Path
 
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
+from collections import OrderedDict
 
-from PyQt5.QtCore import pyqtSignal, QThread, QTimer
-from PyQt5.QtGui import QFont, QIcon, QColor, QBrush
+from PyQt5.QtCore import pyqtSignal, QThread, QTimer, QDateTime
+from PyQt5.QtGui import QFont, QIcon
 from PyQt5.QtWidgets import QApplication, QMainWindow, QTabWidget, QDialog, QAction
 from PyQt5.QtWidgets import QVBoxLayout, QGridLayout, QTableWidget, QTableWidgetItem
-from PyQt5.QtWidgets import QPushButton, QComboBox, QCheckBox, QLineEdit, QLabel
+from PyQt5.QtWidgets import QPushButton, QComboBox, QLineEdit, QLabel
+from PyQt5.QtWidgets import QDateTimeEdit, QFileDialog, QProgressDialog, QInputDialog
 
+from alerts import AlertEngine
 from broker import MQTT_Broker
 from config import parse_args
+from export import ExportThread, HistoryRecorder, history_rows, snapshot_rows
+from fleet import LeafRegistry
+from plot import FastDataDialog, sample
+from profiler import profiler, span
+from snapshot import SnapshotWriter
+from table import LeafTable
 
 args = parse_args()
 config = args.config
@@ -26,6 +32,33 @@ logging.basicConfig(level="INFO", format="%(name)s [%(levelname)s]: %(message)s"
 
 
 class SolarLEAF:
+    # Attribute shown in each table column, in the order of items()[1:]
+    COLUMNS = [
+        "time",
+        "gateway",
+        "mac",
+        "BMS_SOC",
+        "BMS_Min_Cell_V",
+        "BMS_Max_Cell_V",
+        "VPV",
+        "IPV",
+        "P_PV",
+        "VBAT",
+        "IBAT",
+        "P_BAT",
+        "VOUT",
+        "IOUT",
+        "P_OUT",
+        "VCOM",
+        "VOUT_X",
+        "FET_T",
+        "TEMP_PCB",
+        "sl_status",
+        "FW_CRC",
+        "VERSION",
+        "gaps",
+    ]
+
     def __init__(self, gateway, macaddr, index):
         self.index = index
         self.mac = macaddr
@@ -43,6 +76,8 @@ class SolarLEAF:
         self.sl_status = self.FW_CRC = self.VERSION = self.bmsversion = ""
 
         self.last = time.time()
+        self.gaps = 0
+        self.gap_time = 0.0
 
     def items(self):
         self.time = time.strftime("%H:%M:%S", time.localtime())
@@ -71,12 +106,14 @@ class SolarLEAF:
             f"{self.FW_CRC}",
             f"{self.VERSION}",
             # f"{self.bmsversion}",
+            f"{self.gaps}",
         ]
         return items
 
 
 class MainWindow(QMainWindow):
     TIMEOUT = 65
+    PRESENCE_INTERVAL = config.get("subscriptions", {}).get("presence_interval", 60)
 
     FONT_SIZE = 8
     FONT = QFont("Courier")
@@ -85,10 +122,18 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
 
+        self.alerts = AlertEngine.from_config(config)
+        self.registry = LeafRegistry.from_config(config)
+        self.snapshot = SnapshotWriter.from_config(config)
+        profiler.directory = Path(config.get("profile", {}).get("dir", "profiles"))
+        self.profile_run = 0
+        self.history = HistoryRecorder.from_config(config, SolarLEAF.COLUMNS[1:])
+        self.exports: list[ExportThread] = list()
+        self.plots: list[FastDataDialog] = list()
         self.brokers = self._init_brokers()
         self.tabs: dict[int, str] = dict()
         self.timers: dict[str, QTimer] = dict()
-        self.tables: dict[int, QTableWidget] = dict()
+        self.tables: dict[str, LeafTable] = dict()
         self.threads: dict[str, UpdateTableThread] = dict()
 
         self._initUI()
@@ -99,11 +144,12 @@ class MainWindow(QMainWindow):
         brokers: dict[str:MQTT_Broker] = dict()
         broker_dict = config["gateways"]
         for name, host in broker_dict.items():
+            # Brokers keep retrying in the background until they connect
             try:
-                broker = MQTT_Broker(broker_dict[f"{name}"])
+                broker = MQTT_Broker(broker_dict[f"{name}"], name)
                 broker.start()
             except Exception as err:
-                log.info(f"Couldn't connect to {name}@{host} error: {err}")
+                log.info(f"Couldn't start {name}@{host} error: {err}")
             else:
                 brokers[f"{name}"] = broker
 
@@ -119,9 +165,30 @@ class MainWindow(QMainWindow):
 
         self.setCentralWidget(self.tabMenu)
 
+        # Gateway Connection State
+        self.connections = QLabel()
+        self.connections.setFont(self.FONT)
+        self.statusBar().addPermanentWidget(self.connections)
+        self.connection_timer = QTimer()
+        self.connection_timer.timeout.connect(self.update_connections)
+        self.connection_timer.start(1000)
+
+        # Publish the live fleet state for other local processes
+        if self.snapshot:
+            self.snapshot_timer = QTimer()
+            self.snapshot_timer.timeout.connect(self.write_snapshot)
+            self.snapshot_timer.start(config["snapshot"].get("interval", 1000))
+
         # File Menu
         fMenu = self.menuBar().addMenu("File")
         fMenu.addAction(QAction("Add Gateway", self, triggered=self.popup_add))
+        fMenu.addAction(
+            QAction("Reconnect Gateways", self, triggered=self.reconnect_brokers)
+        )
+        fMenu.addAction(
+            QAction("Export Snapshot", self, triggered=self.export_snapshot)
+        )
+        fMenu.addAction(QAction("Export History", self, triggered=self.popup_export))
 
         # Command Menu
         cMenu = self.menuBar().addMenu("Command")
@@ -131,6 +198,16 @@ class MainWindow(QMainWindow):
         cMenu.addAction(QAction("Change SSID", self, triggered=self.popup_ssid))
         cMenu.addAction(QAction("Set Parameters", self, triggered=self.popup_parameter))
 
+        # Alert Menu
+        aMenu = self.menuBar().addMenu("Alerts")
+        aMenu.addAction(QAction("Alert Log", self, triggered=self.popup_alerts))
+
+        # Diagnostics Menu
+        dMenu = self.menuBar().addMenu("Diagnostics")
+        self.profile_action = QAction("Profile", self, checkable=True)
+        self.profile_action.toggled.connect(self.toggle_profile)
+        dMenu.addAction(self.profile_action)
+
         pMenu = self.menuBar().addMenu("Print")
         checkboxAction = QAction("Toggle Printing", self)
         checkboxAction.triggered.connect(lambda: self.print_type("print"))
@@ -168,29 +245,19 @@ class MainWindow(QMainWindow):
         # timer.timeout.connect(self.update_window)
         # timer.start(1000)  # Update every second
 
+    @span("add_item_to_table")
     def add_item_to_table(self, gateway, leaf):
-        # Add a new item to the table widget
-        item = leaf.items()
+        # Add or update the leaf's row, the model keeps sort and filter order
         if gateway not in self.tabs.values():
             return
 
-        table = self.tables[gateway]
-        index = int(item.pop(0)) - 1  # Remove index from items
+        self.tables[gateway].update_leaf(leaf)
 
-        # Implement New Entry
-        if index >= table.rowCount():
-            table.setRowCount(index + 1)
-
-        # Update Entry Based on leaf.index
-        for i, value in enumerate(item):
-            currEntry = QTableWidgetItem(str(value))
-            currEntry.setFont(self.FONT)
-            table.setItem(index, i, currEntry)
+    def remove_from_table(self, gateway, macs):
+        if gateway not in self.tabs.values():
+            return
 
-        # Resize to Contents
-        table.resizeRowsToContents()
-        table.resizeColumnsToContents()
-        # self.adjustSize()
+        self.tables[gateway].remove_leaves(macs)
 
     def add_tab(self, index):
         # Track Current Tab Based on Index
@@ -198,33 +265,26 @@ class MainWindow(QMainWindow):
         gateway = self.combo_box.currentText()
         self.tabs[index] = gateway
 
-        table = QTableWidget(itemClicked=self.selected_unit)
+        table = LeafTable(
+            config["list"]["header"],
+            SolarLEAF.COLUMNS,
+            self.TIMEOUT,
+            self.FONT,
+            alerting=self.alerts.alerting,
+        )
         self.tables[gateway] = table
         self.tabMenu.addTab(table, gateway)
 
-        # Style and Fonts
-        table.setColumnCount(len(config["list"]["header"]))
-        table.setHorizontalHeaderLabels(config["list"]["header"])
-        style = "background-color: rgb(200, 200, 200); border: none;"
-        table.setStyleSheet(f"QHeaderView::section { {style}}")
-        table.setShowGrid(False)
-        table.horizontalHeader().setFont(self.FONT)
-        font = table.horizontalHeader().font()
-        font.setBold(True)
-        table.horizontalHeader().setFont(font)
-
         # Initialize Specific Broker
         broker = self.brokers[gateway]
+        broker.set_mode("telemetry")
         thread = UpdateTableThread(self, broker, gateway, self.tabs)
         thread.slow_signal.connect(self.add_item_to_table)
+        thread.alert_signal.connect(self.show_alert)
+        thread.evict_signal.connect(self.remove_from_table)
         thread.start()
         self.threads[gateway] = thread
 
-        # Resize to Contents
-        table.resizeRowsToContents()
-        table.resizeColumnsToContents()
-        # self.adjustSize()
-
         # Set New Tab as Current Tab
         self.tabMenu.setCurrentIndex(self.tabMenu.count() - 1)
 
@@ -248,17 +308,17 @@ class MainWindow(QMainWindow):
         timer = self.timers[gateway]
         timer.stop()
 
+        # Nobody watches the gateway anymore, only track presence
+        self.brokers[gateway].set_mode("presence")
+
         del self.timers[gateway]
-        del self.tabs[index]
-        new_tabs: dict = dict()
 
-        for key, value in self.tabs.items():
-            if key > 0:
-                new_tabs[key - 1] = value
-            else:
-                new_tabs[key] = value
+        # Shift following tabs in place, the threads share this dict
+        count = len(self.tabs)
+        for key in range(index, count - 1):
+            self.tabs[key] = self.tabs[key + 1]
+        del self.tabs[count - 1]
 
-        self.tabs = new_tabs
         self.tabMenu.removeTab(index)
 
     def popup_add(self):
@@ -282,6 +342,66 @@ class MainWindow(QMainWindow):
         self.gw_dialog.setLayout(layout)
         self.gw_dialog.exec_()
 
+    def popup_alerts(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Alert Log")
+        dialog.setWindowIcon(QIcon("share/shield.png"))
+
+        history = list(self.alerts.history)
+        table = QTableWidget(len(history), 4)
+        table.setHorizontalHeaderLabels(["Time", "Gateway", "MAC", "Alert"])
+        table.setShowGrid(False)
+
+        for row, (timestamp, gateway, mac, message) in enumerate(reversed(history)):
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+            for col, value in enumerate([stamp, gateway, mac, message]):
+                entry = QTableWidgetItem(value)
+                entry.setFont(self.FONT)
+                table.setItem(row, col, entry)
+
+        table.resizeColumnsToContents()
+
+        layout = QVBoxLayout()
+        layout.addWidget(table)
+        dialog.setLayout(layout)
+        dialog.resize(600, 300)
+        dialog.exec_()
+
+    def popup_export(self):
+        if not self.history:
+            message = "History recording is disabled, set [history] dir in config"
+            log.info(message)
+            self.statusBar().showMessage(message)
+            return
+
+        self.export_dialog = QDialog(self)
+        self.export_dialog.setWindowTitle("Export History")
+        self.export_dialog.setGeometry(*self.dialog_geometry)
+
+        data = self.selected_unit()
+        macs = QLineEdit(data[1] if data else "")
+        macs.setPlaceholderText("MACs, comma separated (all if empty)")
+
+        now = QDateTime.currentDateTime()
+        start = QDateTimeEdit(now.addDays(-1), calendarPopup=True)
+        end = QDateTimeEdit(now, calendarPopup=True)
+
+        layout = QGridLayout()
+        layout.addWidget(QLabel("MACs"), 0, 0)
+        layout.addWidget(macs, 0, 1)
+        layout.addWidget(QLabel("From"), 1, 0)
+        layout.addWidget(start, 1, 1)
+        layout.addWidget(QLabel("To"), 2, 0)
+        layout.addWidget(end, 2, 1)
+        layout.addWidget(
+            QPushButton("Export", clicked=lambda: self.export_history(macs, start, end)),
+            3,
+            1,
+        )
+
+        self.export_dialog.setLayout(layout)
+        self.export_dialog.exec_()
+
     def popup_find(self):
         self.sl_dialog = QDialog(self)
         self.sl_dialog.setWindowTitle("Find Unit")
@@ -297,23 +417,21 @@ class MainWindow(QMainWindow):
         self.sl_dialog.exec_()
 
     def popup_fast(self):
-        data = self.selected_unit()
-        if not data:
+        current_index = self.tabMenu.currentIndex()
+        if current_index == -1:
+            log.info("Add a tab and select a row to continue")
             return
 
-        gateway, mac = (data[0], data[1])
-        broker = self.brokers[gateway]
-
-        broker.publish(f"Yotta/{mac}/cmd", payload="set fast_period 1")
-        log.info(f"Enabled fast data on {mac}")
-
-        data_thread = self.threads[gateway]
-        dialog = FastDataDialog(data_thread, mac)
-        dialog.exec_()
-        time.sleep(1)
+        # Every selected unit is overlaid on one plot, more can be added by MAC
+        leaves = self.tables[self.tabs[current_index]].selected()
+        if not leaves:
+            log.info("No row selected.")
+            return
 
-        broker.publish(f"Yotta/{mac}/cmd", payload="set fast_period 0")
-        log.info(f"Disabled fast data on {mac}")
+        dialog = FastDataDialog(self, [(leaf.gateway, leaf.mac) for leaf in leaves])
+        dialog.finished.connect(lambda: self.plots.remove(dialog))
+        self.plots.append(dialog)
+        dialog.show()
 
     def popup_ssid(self):
         data = self.selected_unit()
@@ -427,27 +545,122 @@ class MainWindow(QMainWindow):
         self.update_dialog.exec_()
 
     ### HELPER FUNCTIONS ###
+    def connection_text(self, gateway):
+        broker = self.brokers[gateway]
+        if broker.connected:
+            return gateway
+        downtime = time.strftime("%H:%M:%S", time.gmtime(broker.downtime))
+        return f"{gateway} ({broker.state} {downtime})"
+
+    def update_connections(self):
+        for index, gateway in self.tabs.items():
+            self.tabMenu.setTabText(index, self.connection_text(gateway))
+
+        states = [self.connection_text(gateway) for gateway in self.brokers]
+        self.connections.setText(" | ".join(states))
+
+        # Feed the MAC location index from every gateway, watched or not
+        for gateway, broker in self.brokers.items():
+            self.registry.sighted(gateway, broker.sightings())
+
+    def toggle_profile(self, checked):
+        # Worker threads pick the change up at their next loop checkpoint
+        if not checked:
+            profiler.stop()
+            profiler.checkpoint("gui")
+            return
+
+        seconds, ok = QInputDialog.getInt(
+            self, "Profile", "Seconds to profile (0 until stopped)", 30, 0, 3600
+        )
+        if not ok:
+            # Profiling never started, don't run the stop path
+            self.profile_action.blockSignals(True)
+            self.profile_action.setChecked(False)
+            self.profile_action.blockSignals(False)
+            return
+
+        profiler.start()
+        profiler.checkpoint("gui")
+
+        self.profile_run += 1
+        if seconds:
+            run = self.profile_run
+            QTimer.singleShot(seconds * 1000, lambda: self.stop_profile(run))
+
+    def stop_profile(self, run):
+        if run == self.profile_run:
+            self.profile_action.setChecked(False)
+
+    def write_snapshot(self):
+        self.snapshot.write(self.registry.leaves())
+
+    def reconnect_brokers(self):
+        for gateway, broker in self.brokers.items():
+            if not broker.connected:
+                log.info(f"Reconnecting {gateway}")
+                broker.reconnect()
+
+    def show_alert(self, gateway, mac, message):
+        self.statusBar().showMessage(f"Alert: {gateway} - {mac}: {message}")
+
+    @span("set_timeout_color")
     def set_timeout_color(self, gateway):
-        table = self.tables[gateway]
+        # Timeout color comes from leaf.last, only visible rows are repainted
+        self.tables[gateway].refresh()
 
-        for i in range(table.rowCount()):
-            mac = table.item(i, 1).text()
+    def export_path(self, title):
+        path, selected = QFileDialog.getSaveFileName(
+            self, title, "", "CSV (*.csv);;Columnar (*.npz)"
+        )
 
-            time_index = 0  # len(config["list"]["header"]) - 1
-            time_str = table.item(i, time_index).text()
-            date_obj = datetime.combine(
-                datetime.today(),
-                datetime.strptime(time_str, "%H:%M:%S").time(),
-            )
-            last_time = int(date_obj.timestamp())
+        # Names typed without an extension take it from the chosen filter
+        if path and not Path(path).suffix:
+            path += ".npz" if "*.npz" in selected else ".csv"
+        return path
 
-            diff_time = time.time() - last_time
-            if diff_time > self.TIMEOUT:
-                for j in range(table.columnCount()):
-                    table.item(i, j).setForeground(QBrush(QColor(255, 0, 0)))
-            else:
-                for j in range(table.columnCount()):
-                    table.item(i, j).setForeground(QBrush(QColor(0, 0, 0)))
+    def export_snapshot(self):
+        path = self.export_path("Export Snapshot")
+        if not path:
+            return
+
+        leaves = self.registry.leaves()
+        fields = SolarLEAF.COLUMNS[1:]
+        self.start_export(path, fields, snapshot_rows(leaves, fields))
+
+    def export_history(self, macs, start, end):
+        path = self.export_path("Export History")
+        if not path:
+            return
+
+        self.export_dialog.accept()
+
+        macs = [mac.strip() for mac in macs.text().split(",") if mac.strip()]
+        start = start.dateTime().toSecsSinceEpoch()
+        end = end.dateTime().toSecsSinceEpoch()
+        fields = SolarLEAF.COLUMNS[1:]
+        source = history_rows(self.history.directory, fields, macs, start, end)
+        self.start_export(path, fields, source)
+
+    def start_export(self, path, fields, source):
+        # Rows are streamed chunk by chunk on a worker thread
+        thread = ExportThread(path, ["timestamp"] + fields, source)
+
+        progress = QProgressDialog(f"Exporting {path}", "Cancel", 0, 100, self)
+        progress.setWindowTitle("Export")
+        progress.canceled.connect(thread.cancel)
+        thread.progress_signal.connect(progress.setValue)
+        thread.done_signal.connect(progress.close)
+        thread.done_signal.connect(self.export_done)
+        thread.finished.connect(lambda: self.exports.remove(thread))
+
+        self.exports.append(thread)
+        thread.start()
+        progress.show()
+
+    def export_done(self, message):
+        log.info(message)
+        self.statusBar().showMessage(message)
 
     def search_for_unit(self):
         mac_to_find = self.sl_dialog.findChild(QLineEdit).text()
@@ -462,21 +675,32 @@ class MainWindow(QMainWindow):
 
         log.info(f"Looking for mac: {mac_to_find}")
 
+        # Only trust a sighting younger than the presence poll interval
+        self.update_connections()
+        seen = self.registry.last_seen(mac_to_find)
+        if seen and time.time() - seen[1] < self.PRESENCE_INTERVAL:
+            return self.report_location(mac_to_find)
+
+        # Replies are picked up by every broker's presence tracking
         for gateway, broker in self.brokers.items():
             broker.publish("Yotta/cmd", "getid")
 
-            time.sleep(5)
-            while not broker.queue.empty():
-                msg = broker.get()
-                mac = msg_parts = msg.topic.split("/")[1]
-                if mac == mac_to_find:
-                    self.found_on_gateway = gateway
-                    log.info(f"Found {mac_to_find} on {self.found_on_gateway}")
-                    return self.found_on_gateway
-                else:
-                    log.info(f"{gateway} - {mac} does not match {mac_to_find}")
+        QTimer.singleShot(5000, lambda: self.report_location(mac_to_find))
 
-        log.info(f"{mac_to_find} not found on any gateway")
+    def report_location(self, mac):
+        self.update_connections()
+        seen = self.registry.last_seen(mac)
+        if seen is None:
+            log.info(f"{mac} not found on any gateway")
+            return None
+
+        gateway, when = seen
+        age = time.time() - when
+        self.found_on_gateway = gateway
+        message = f"Found {mac} on {gateway}, last seen {age:.0f}s ago"
+        log.info(message)
+        self.statusBar().showMessage(message)
+        return gateway
 
     def selected_unit(self):
         current_index = self.tabMenu.currentIndex()
@@ -487,17 +711,14 @@ class MainWindow(QMainWindow):
         gateway = self.tabs[current_index]
         table = self.tables[gateway]
 
-        selected = table.selectedItems()
+        selected = table.selected()
         if not len(selected) > 0:
             log.info("No row selected.")
             return
 
-        row = selected[0].row()
-        cols = table.columnCount()
-        items = [table.item(row, col).text() for col in range(cols)]
-
-        log.info(f"Selected {items[1]} on row {row+1} on {items[0]}")
-        return items
+        leaf = selected[0]
+        log.info(f"Selected {leaf.mac} on row {leaf.index} on {leaf.gateway}")
+        return [leaf.gateway, leaf.mac]
 
     def change_ssid(self):
         ssid = self.ssid_dialog.findChild(QLineEdit).text()
@@ -621,7 +842,17 @@ class MainWindow(QMainWindow):
 
 class UpdateTableThread(QThread):
     slow_signal = pyqtSignal(str, SolarLEAF)
-    plot_signal = pyqtSignal(str, SolarLEAF)
+    fast_signal = pyqtSignal(str, str, object)
+    alert_signal = pyqtSignal(str, str, str)
+    evict_signal = pyqtSignal(str, list)
+
+    BATCH = 500
+    GAP = config.get("mqtt", {}).get("gap", MainWindow.TIMEOUT)
+
+    # Eviction of departed units, 0 disables a limit
+    TTL = config.get("eviction", {}).get("ttl", 0)
+    MAX_UNITS = config.get("eviction", {}).get("max_units", 0)
+    EVICT_INTERVAL = config.get("eviction", {}).get("interval", 10)
 
     def __init__(self, window, broker, gateway, tabs):
         super().__init__()
@@ -631,29 +862,56 @@ class UpdateTableThread(QThread):
         self.gateway = gateway
         self.tabs = tabs
 
-        self.Leaves: dict[str, SolarLEAF] = dict()
+        # Kept in LRU order, the least recently updated unit comes first
+        self.Leaves: OrderedDict[str, SolarLEAF] = OrderedDict()
+        self.evicted = time.time()
 
     def run(self):
         while True:
+            profiler.checkpoint(f"table-{self.gateway}")
+
             if self.gateway not in self.tabs.values():
                 print(f"Thread terminated for {self.gateway}")
+                profiler.finish(f"table-{self.gateway}")
+                self.window.registry.release(self.gateway, self.Leaves.values())
                 return
 
-            try:
-                data = self.broker.get()
-                speed, items = self.process(self.gateway, data)
-            except Exception as err:
-                print(f"UpdateTable Error: {err}")
-            else:
-                if not items:
-                    break
+            if time.time() - self.evicted > self.EVICT_INTERVAL:
+                self.evict()
 
+            # Drain everything queued since the last pass as one batch
+            batch: dict[str, SolarLEAF] = dict()
+            for data in self.broker.get_batch(self.BATCH):
+                try:
+                    speed, leaf = self.process(self.gateway, data)
+                except Exception as err:
+                    print(f"UpdateTable Error: {err}")
+                    continue
+
+                # Fast samples are copied so none are lost to later updates
                 if speed == "fast":
-                    self.plot_signal.emit(self.gateway, items)
-                self.slow_signal.emit(self.gateway, items)
+                    self.fast_signal.emit(self.gateway, leaf.mac, sample(leaf))
+                batch[leaf.mac] = leaf
+
+            if not batch:
+                continue
 
-                time.sleep(0.1)
+            leaves = list(batch.values())
+            # Silent units keep their last values, they don't count as peers
+            now = time.time()
+            peers = [l for l in self.Leaves.values() if now - l.last <= MainWindow.TIMEOUT]
+            for alert in self.window.alerts.evaluate(self.gateway, leaves, peers):
+                self.alert_signal.emit(*alert)
 
+            if self.window.history:
+                self.window.history.record(leaves)
+
+            for leaf in leaves:
+                self.slow_signal.emit(self.gateway, leaf)
+
+            time.sleep(0.1)
+
+    @span("process")
     def process(self, gateway, msg):
         if not re.match("Yotta/............/", msg.topic):
             return
@@ -666,106 +924,75 @@ class UpdateTableThread(QThread):
             print(payload)
 
         # Associate SolarLeaf with Gateway
-        index = len(self.Leaves) + 1
-        leaf = self.Leaves.setdefault(mac, SolarLEAF(gateway, mac, index))
-        leaf.last = time.time()
+        leaf = self.Leaves.get(mac)
+        if leaf is None:
+            leaf = self.adopt(gateway, mac)
+        else:
+            self.Leaves.move_to_end(mac)
+
+        # Gap Detection
+        now = time.time()
+        gap = now - leaf.last
+        if gap > self.GAP:
+            leaf.gaps += 1
+            leaf.gap_time += gap
+            log.info(f"{gateway} - {mac} gap of {gap:.0f}s ({leaf.gaps} total)")
+        leaf.last = now
 
         [self.set_key(leaf, payload, name) for name in config["list"]["names"]]
 
         return speed, leaf
 
-    def set_key(self, leaf, data, name: str):
-        if name in data.keys():
-            setattr(leaf, name, data[name])
-
-
-class FastDataDialog(QDialog):
-    def __init__(self, thread, mac, parent=None):
-        super(FastDataDialog, self).__init__(parent)
+    def adopt(self, gateway, mac):
+        # Take over the unit's state if it was seen on another gateway before
+        index = len(self.Leaves) + 1
+        leaf = self.window.registry.claim(mac, gateway)
+        if leaf is None:
+            leaf = SolarLEAF(gateway, mac, index)
+        else:
+            log.info(f"{mac} moved from {leaf.gateway} to {gateway}")
+            leaf.gateway = gateway
+            leaf.index = index
+
+        self.window.registry.register(mac, gateway, leaf)
+        self.Leaves[mac] = leaf
+        return leaf
+
+    def evict(self):
+        self.evicted = now = time.time()
+
+        evicted = list()
+        for mac, leaf in self.Leaves.items():
+            if self.MAX_UNITS and len(self.Leaves) - len(evicted) > self.MAX_UNITS:
+                evicted.append(leaf)
+            elif self.TTL and now - leaf.last > self.TTL:
+                evicted.append(leaf)
+            else:
+                break
 
-        self.setWindowTitle(f"Fast Data: {mac}")
-        self.setWindowIcon(QIcon("share/shield.png"))
+        handoffs = self.window.registry.handoffs(self.gateway)
+        if not evicted and not handoffs:
+            return
 
-        thread.plot_signal.connect(self.update_plot)
-
-        self.data = [[], [], [], [], [], [], [], [], [], []]
-
-        self.labels = [
-            "self.VPV",
-            "self.IPV",
-            "self.P_PV",
-            "self.VBAT",
-            "self.IBAT",
-            "self.P_BAT",
-            "self.VOUT",
-            "self.IOUT",
-            "self.P_OUT",
-            "self.VCOM",
-        ]
+        for leaf in evicted:
+            del self.Leaves[leaf.mac]
+        for mac in handoffs:
+            self.Leaves.pop(mac, None)
 
-        # Set up the Matplotlib figure and canvas
-        self.figure = Figure(figsize=(1, 1), dpi=100)
-        self.canvas = FigureCanvas(self.figure)
-        self.axes = self.figure.add_subplot(111)
-
-        # Create Axes
-        self.lines: dict = dict()
-        for i, name in enumerate(self.labels):
-            self.lines[i] = self.create_axes(label=name)
-
-        # Add legend
-        self.axes.legend()
-
-        # Set up the layout
-        self.layout = QVBoxLayout()
-        self.layout.addWidget(self.canvas)
-
-        # Create Checkboxes
-        self.checkboxes: dict = dict()
-        for i, name in enumerate(self.labels):
-            self.checkboxes[i] = self.create_checkbox(label=name)
-
-        self.setLayout(self.layout)
-        self.resize(500, 500)
-
-    def create_axes(self, label=""):
-        return self.axes.plot([], [], label=label)
-
-    def create_checkbox(self, label=""):
-        checkbox = QCheckBox(label)
-        checkbox.setChecked(False)
-        checkbox.stateChanged.connect(self.visibility)
-        self.layout.addWidget(checkbox)
-        return checkbox
-
-    def convert_to_float(self, value):
-        return float(value.strip(" ").strip("W").strip("V").strip("A"))
-
-    def update_plot(self, gateway, leaf):
-        # Append New Data
-        new_data = leaf.items()
-        for i, data in enumerate(new_data[6:16]):
-            self.data[i].append(self.convert_to_float(data))
-
-        # Set New Data
-        length = np.arange(len(self.data[0]))
-        for i, line in self.lines.items():
-            if self.checkboxes[i]:
-                line[0].set_data(length, self.data[i])
-            else:
-                line.set_data([], [])
+        self.window.registry.release(self.gateway, evicted)
+        self.window.alerts.forget([leaf.mac for leaf in evicted])
 
-        # Update
-        self.axes.relim()
-        self.axes.autoscale_view()
-        self.canvas.draw()
+        # Compact row indices, keeping arrival order
+        for i, leaf in enumerate(sorted(self.Leaves.values(), key=lambda l: l.index)):
+            leaf.index = i + 1
 
-    def visibility(self):
-        # Change Visibility on Plot
-        for i, line in self.lines.items():
-            line[0].set_visible(self.checkboxes[i].isChecked())
+        macs = [leaf.mac for leaf in evicted] + list(handoffs)
+        log.info(f"{self.gateway} evicted {len(macs)} units, {len(self.Leaves)} left")
+        self.evict_signal.emit(self.gateway, macs)
 
-        self.canvas.draw()
+    def set_key(self, leaf, data, name: str):
+        if name in data.keys():
+            setattr(leaf, name, data[name])
 
 
 if __name__ == "__main__":
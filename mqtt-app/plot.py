@@ -0,0 +1,199 @@
+import time
+import logging
+import numpy as np
+
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QGridLayout
+from PyQt5.QtWidgets import QCheckBox, QLineEdit, QPushButton
+
+from alerts import to_float
+from profiler import span
+
+log = logging.getLogger(__name__)
+
+
+CHANNELS = ["VPV", "IPV", "P_PV", "VBAT", "IBAT", "P_BAT", "VOUT", "IOUT", "P_OUT", "VCOM"]
+
+
+def sample(leaf):
+    """Copy of a leaf's fast channels as [time, *CHANNELS]."""
+    values = [leaf.last] + [getattr(leaf, name) for name in CHANNELS]
+    return np.fromiter(map(to_float, values), dtype=float, count=len(values))
+
+
+class RingBuffer:
+    """Fixed size sample buffer whose newest `size` rows are one contiguous view.
+
+    Every row is written twice, `size` rows apart, so reading never copies.
+    """
+
+    def __init__(self, size, width):
+        self.size = size
+        self.data = np.zeros((2 * size, width))
+        self.index = 0
+        self.count = 0
+
+    def append(self, row):
+        self.data[self.index] = self.data[self.index + self.size] = row
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def view(self):
+        end = self.index + self.size
+        return self.data[end - self.count : end]
+
+
+class FastDataDialog(QDialog):
+    """Overlays fast data channels of several units, from any gateway, on one canvas.
+
+    Samples are routed per MAC into ring buffers as they arrive and every series
+    is redrawn together at most once per REDRAW milliseconds.
+    """
+
+    SAMPLES = 2000
+    REDRAW = 200
+
+    def __init__(self, window, units, parent=None):
+        super(FastDataDialog, self).__init__(parent)
+
+        self.setWindowTitle("Fast Data")
+        self.setWindowIcon(QIcon("share/shield.png"))
+
+        self.window = window
+        self.start = time.time()
+        self.dirty = False
+
+        self.units: dict[str, str] = dict()
+        self.buffers: dict[str, RingBuffer] = dict()
+        self.lines: dict[tuple[str, str], object] = dict()
+        self.threads: dict[str, object] = dict()
+
+        # Set up the Matplotlib figure and canvas
+        self.figure = Figure(figsize=(1, 1), dpi=100)
+        self.canvas = FigureCanvas(self.figure)
+        self.axes = self.figure.add_subplot(111)
+        self.axes.set_xlabel("s")
+
+        # Set up the layout
+        self.layout = QVBoxLayout()
+        self.layout.addWidget(self.canvas)
+
+        # Create Checkboxes
+        grid = QGridLayout()
+        self.checkboxes: dict[str, QCheckBox] = dict()
+        for i, name in enumerate(CHANNELS):
+            checkbox = QCheckBox(name)
+            checkbox.setChecked(name == "VPV")
+            checkbox.stateChanged.connect(self.visibility)
+            grid.addWidget(checkbox, i // 5, i % 5)
+            self.checkboxes[name] = checkbox
+        self.layout.addLayout(grid)
+
+        # Add Units By MAC
+        self.mac = QLineEdit(placeholderText="Add unit by MAC")
+        row = QHBoxLayout()
+        row.addWidget(self.mac)
+        row.addWidget(QPushButton("Add", clicked=self.add_mac))
+        self.layout.addLayout(row)
+
+        self.setLayout(self.layout)
+        self.resize(700, 600)
+
+        for gateway, mac in units:
+            self.add_unit(gateway, mac)
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.update_plot)
+        self.timer.start(self.REDRAW)
+
+    def add_mac(self):
+        mac = self.mac.text().strip()
+        gateway = self.window.registry.location(mac)
+        if gateway is None:
+            log.info(f"{mac} not seen on any open gateway")
+            return
+
+        self.mac.clear()
+        self.add_unit(gateway, mac)
+
+    def add_unit(self, gateway, mac):
+        if mac in self.units:
+            return
+
+        thread = self.window.threads.get(gateway)
+        if thread is None or not thread.isRunning():
+            log.info(f"Open a tab for {gateway} to plot {mac}")
+            return
+
+        # One connection per gateway thread, samples are routed by MAC
+        if gateway not in self.threads:
+            thread.fast_signal.connect(self.append)
+            self.threads[gateway] = thread
+
+        self.units[mac] = gateway
+        self.buffers[mac] = RingBuffer(self.SAMPLES, len(CHANNELS) + 1)
+        self.setWindowTitle(f"Fast Data: {', '.join(self.units)}")
+
+        broker = self.window.brokers[gateway]
+        broker.add_fast(mac)
+        broker.publish(f"Yotta/{mac}/cmd", "set fast_period 1")
+        log.info(f"Enabled fast data on {mac}")
+
+    def append(self, gateway, mac, values):
+        buffer = self.buffers.get(mac)
+        if buffer is None:
+            return
+
+        buffer.append(values)
+        self.dirty = True
+
+    def line(self, mac, name):
+        key = (mac, name)
+        if key not in self.lines:
+            self.lines[key] = self.axes.plot([], [], label=f"{mac} {name}")[0]
+            self.axes.legend(fontsize="small")
+        return self.lines[key]
+
+    @span("update_plot")
+    def update_plot(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+
+        # Set New Data on every visible series, then draw once
+        for mac, buffer in self.buffers.items():
+            data = buffer.view()
+            for i, name in enumerate(CHANNELS):
+                if self.checkboxes[name].isChecked():
+                    self.line(mac, name).set_data(data[:, 0] - self.start, data[:, i + 1])
+
+        self.axes.relim(visible_only=True)
+        self.axes.autoscale_view()
+        self.canvas.draw_idle()
+
+    def visibility(self):
+        # Change Visibility on Plot
+        for (mac, name), line in self.lines.items():
+            line.set_visible(self.checkboxes[name].isChecked())
+
+        self.dirty = True
+        self.update_plot()
+
+    def done(self, result):
+        self.timer.stop()
+        for thread in self.threads.values():
+            thread.fast_signal.disconnect(self.append)
+
+        # Units still shown by another plot keep their fast data
+        for mac, gateway in self.units.items():
+            broker = self.window.brokers[gateway]
+            if broker.remove_fast(mac):
+                continue
+            broker.publish(f"Yotta/{mac}/cmd", "set fast_period 0")
+            log.info(f"Disabled fast data on {mac}")
+
+        super(FastDataDialog, self).done(result)
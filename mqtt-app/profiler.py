@@ -0,0 +1,134 @@
+import json
+import time
+import logging
+import cProfile
+import threading
+import functools
+
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+
+class Profiler:
+    """On demand cProfile of every app thread plus timing spans of hot spots.
+
+    cProfile only profiles the thread that enables it, so every thread calls
+    checkpoint() from its loop to start or stop its own profile. Each thread
+    dumps a pstats file when it stops, spans are dumped as a Chrome trace
+    (chrome://tracing, Perfetto) when profiling is stopped.
+    """
+
+    def __init__(self, directory="profiles"):
+        self.directory = Path(directory)
+        self.enabled = False
+        self.stamp = ""
+        self.origin = 0.0
+
+        self.profiles: dict[str, cProfile.Profile] = dict()
+        self.spans: list[tuple] = list()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime())
+        self.origin = time.perf_counter()
+        self.spans = list()
+        self.enabled = True
+        log.info(f"Profiling started, writing to {self.directory}")
+
+    def stop(self):
+        if not self.enabled:
+            return
+
+        self.enabled = False
+        with self.lock:
+            spans, self.spans = self.spans, list()
+
+        path = self.directory / f"{self.stamp}-spans.json"
+        with open(path, "w") as f:
+            json.dump(self.trace(spans), f)
+        log.info(f"Profiling stopped, spans written to {path}")
+
+    def checkpoint(self, name):
+        """Start or stop profiling the calling thread to follow `enabled`."""
+        self.local.name = name
+        profile = self.profiles.get(name)
+        if self.enabled and profile is None:
+            profile = self.profiles[name] = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as err:
+                # Python 3.12+ allows a single active cProfile per process
+                log.info(f"Couldn't profile {name}, error: {err}")
+                self.profiles[name] = False
+        elif not self.enabled and profile is not None:
+            self.finish(name)
+
+    def finish(self, name):
+        profile = self.profiles.pop(name, None)
+        if not profile:
+            return
+
+        profile.disable()
+        path = self.directory / f"{self.stamp}-{name}.prof"
+        profile.dump_stats(path)
+        log.info(f"Profile of {name} written to {path}")
+
+    def record(self, name, start, end):
+        thread = getattr(self.local, "name", threading.current_thread().name)
+        with self.lock:
+            self.spans.append((name, thread, start, end))
+
+    def trace(self, spans):
+        threads: dict[str, int] = dict()
+        events = list()
+        for name, thread, start, end in spans:
+            tid = threads.setdefault(thread, len(threads) + 1)
+            events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "pid": 1,
+                    "tid": tid,
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": (end - start) * 1e6,
+                }
+            )
+
+        for thread, tid in threads.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": tid,
+                    "args": {"name": thread},
+                }
+            )
+
+        return {"traceEvents": events}
+
+
+profiler = Profiler()
+
+
+def span(name):
+    """Record a timing span around the decorated function while profiling."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, start, time.perf_counter())
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,208 @@
+import mmap
+import time
+import struct
+import logging
+import numpy as np
+
+from pathlib import Path
+
+from alerts import to_float
+
+log = logging.getLogger(__name__)
+
+
+# File Layout (little endian)
+#   header   64 bytes   HEADER struct, zero padded
+#   names    NAME * columns         column names, ascii, zero padded
+#   index    capacity * 2 * width   mac and gateway of each slot, utf-8
+#   columns  columns * capacity     float64, one contiguous array per column
+#
+# width is stored in the header and sized from the longest gateway name.
+#
+# seq is odd while the writer is updating the file, readers copy what they need
+# and retry if seq was odd or changed in the meantime.
+MAGIC = b"YOTTASNP"
+VERSION = 2
+HEADER = struct.Struct("<8sIIIIQdI")
+HEADER_SIZE = 64
+NAME = 16
+MAC = 12
+
+SEQ_OFFSET = 24
+
+COLUMNS = [
+    "last",
+    "BMS_SOC",
+    "BMS_Min_Cell_V",
+    "BMS_Max_Cell_V",
+    "VPV",
+    "IPV",
+    "P_PV",
+    "VBAT",
+    "IBAT",
+    "P_BAT",
+    "VOUT",
+    "IOUT",
+    "P_OUT",
+    "VCOM",
+    "VOUT_X",
+    "FET_T",
+    "TEMP_PCB",
+    "gaps",
+]
+
+
+class Layout:
+    """Offsets and numpy views of a snapshot file mapped in memory."""
+
+    def __init__(self, mm, capacity, names, width):
+        self.capacity = capacity
+        self.names = names
+        self.width = width
+
+        index = HEADER_SIZE + NAME * len(names)
+        data = index + 2 * width * capacity
+
+        self.seq = np.ndarray((1,), dtype="<u8", buffer=mm, offset=SEQ_OFFSET)
+        self.index = np.ndarray((capacity, 2), dtype=f"S{width}", buffer=mm, offset=index)
+        self.data = np.ndarray(
+            (len(names), capacity), dtype="<f8", buffer=mm, offset=data
+        )
+        self.columns = {name: self.data[i] for i, name in enumerate(names)}
+
+    @staticmethod
+    def size(capacity, columns, width):
+        return HEADER_SIZE + NAME * columns + 2 * width * capacity + 8 * columns * capacity
+
+
+class SnapshotWriter:
+    """Publishes the live leaf state into a fixed layout memory mapped file."""
+
+    def __init__(self, path, gateways, capacity=4096, columns=COLUMNS):
+        self.path = Path(path)
+        self.capacity = capacity
+        self.names = columns
+        self.truncated = False
+        self.skipped: set[str] = set()
+
+        # Index slots fit the longest gateway name, rounded up to 8 bytes
+        try:
+            longest = max([MAC] + [len(name.encode()) for name in gateways])
+        except UnicodeEncodeError as err:
+            raise ValueError(f"Gateway names can't be stored in a snapshot: {err}")
+        self.width = -(-longest // 8) * 8
+
+        size = Layout.size(capacity, len(columns), self.width)
+        with open(self.path, "wb") as f:
+            f.truncate(size)
+
+        self.file = open(self.path, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), size)
+
+        header = HEADER.pack(
+            MAGIC, VERSION, capacity, len(columns), 0, 0, 0.0, self.width
+        )
+        self.mm[: len(header)] = header
+        for i, name in enumerate(columns):
+            start = HEADER_SIZE + NAME * i
+            self.mm[start : start + NAME] = name.encode().ljust(NAME, b"\0")
+
+        self.layout = Layout(self.mm, capacity, columns, self.width)
+
+    @classmethod
+    def from_config(cls, config):
+        section = config.get("snapshot", {})
+        if not section.get("path"):
+            return None
+        gateways = config["gateways"].keys()
+        return cls(section["path"], gateways, section.get("capacity", 4096))
+
+    def entry(self, leaf):
+        # Encoded (mac, gateway), None if it doesn't fit an index slot
+        mac, gateway = str(leaf.mac).encode(), str(leaf.gateway).encode()
+        if max(len(mac), len(gateway)) > self.width:
+            if leaf.mac not in self.skipped:
+                log.info(f"Snapshot skips {leaf.mac} on {leaf.gateway}, name too long")
+                self.skipped.add(leaf.mac)
+            return None
+        return (mac, gateway)
+
+    def write(self, leaves):
+        entries = [self.entry(leaf) for leaf in leaves]
+        leaves = [leaf for leaf, entry in zip(leaves, entries) if entry]
+        entries = [entry for entry in entries if entry]
+        if len(leaves) > self.capacity:
+            if not self.truncated:
+                log.info(f"Snapshot holds {self.capacity} of {len(leaves)} units")
+                self.truncated = True
+            leaves = leaves[: self.capacity]
+            entries = entries[: self.capacity]
+
+        count = len(leaves)
+        index = np.array(entries, dtype=f"S{self.width}").reshape(count, 2)
+        data = np.array(
+            [[to_float(getattr(leaf, name, None)) for leaf in leaves] for name in self.names],
+            dtype="<f8",
+        ).reshape(len(self.names), count)
+
+        layout = self.layout
+        seq = int(layout.seq[0])
+        layout.seq[0] = seq + 1
+        layout.index[:count] = index
+        layout.index[count:] = b""
+        layout.data[:, :count] = data
+        layout.data[:, count:] = np.nan
+        struct.pack_into("<I", self.mm, 20, count)
+        struct.pack_into("<d", self.mm, 32, time.time())
+        layout.seq[0] = seq + 2
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+
+class SnapshotReader:
+    """Zero copy reader of a SnapshotWriter file for other local processes.
+
+    `layout.columns` are live numpy views of the file, read() returns a
+    consistent copy of the units currently published.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, capacity, columns, _, _, _, width = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} snapshot file")
+
+        names = list()
+        for i in range(columns):
+            start = HEADER_SIZE + NAME * i
+            names.append(self.mm[start : start + NAME].rstrip(b"\0").decode())
+
+        self.layout = Layout(self.mm, capacity, names, width)
+
+    @property
+    def seq(self):
+        return int(self.layout.seq[0])
+
+    def read(self, retries=100):
+        for _ in range(retries):
+            seq = self.seq
+            if seq % 2:
+                continue
+
+            _, _, _, _, count, _, stamp, _ = HEADER.unpack_from(self.mm)
+            macs = [mac.decode(errors="replace") for mac in self.layout.index[:count, 0]]
+            gateways = [gw.decode(errors="replace") for gw in self.layout.index[:count, 1]]
+            columns = {n: c[:count].copy() for n, c in self.layout.columns.items()}
+
+            if self.seq == seq:
+                return stamp, macs, gateways, columns
+
+        raise TimeoutError("Snapshot kept changing while reading")
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
@@ -0,0 +1,390 @@
+import time
+import bisect
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt5.QtGui import QBrush, QColor
+from PyQt5.QtWidgets import QWidget, QTableView, QAbstractItemView
+from PyQt5.QtWidgets import QHBoxLayout, QVBoxLayout, QLineEdit, QCheckBox, QComboBox
+
+
+TEXT_COLUMNS = {"gateway", "mac", "sl_status", "FW_CRC", "VERSION"}
+
+
+def sort_key(value, text=False):
+    # Numbers sort before text, NaN last
+    if text:
+        return (1, str(value))
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return (1, str(value))
+    if number != number:
+        return (2, 0.0)
+    return (0, number)
+
+
+class SortedIndex:
+    """Row ids kept in order of a sort key, updated in place as values change."""
+
+    def __init__(self):
+        self.keys: list[tuple] = list()
+        self.rows: list[int] = list()
+        self.values: dict[int, tuple] = dict()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, row):
+        return row in self.values
+
+    def position(self, row):
+        key = (self.values[row], row)
+        return bisect.bisect_left(self.keys, key)
+
+    def insert(self, row, key):
+        pos = bisect.bisect_left(self.keys, (key, row))
+        self.keys.insert(pos, (key, row))
+        self.rows.insert(pos, row)
+        self.values[row] = key
+        return pos
+
+    def remove(self, row):
+        pos = self.position(row)
+        del self.keys[pos]
+        del self.rows[pos]
+        del self.values[row]
+        return pos
+
+    def reset(self, keys):
+        self.keys = sorted(keys)
+        self.rows = [row for _, row in self.keys]
+        self.values = dict((row, key) for key, row in self.keys)
+
+
+class LeafFilter:
+    """MAC substring, stale only, version equals and value range filters."""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.mac = ""
+        self.version = ""
+        self.stale = False
+        self.column = None
+        self.minimum = self.maximum = None
+
+    def __call__(self, leaf):
+        if self.mac and self.mac.lower() not in leaf.mac.lower():
+            return False
+        if self.version and str(leaf.VERSION) != self.version:
+            return False
+        if self.stale and time.time() - leaf.last <= self.timeout:
+            return False
+        if self.column is not None:
+            group, value = sort_key(getattr(leaf, self.column, None))
+            if group != 0:
+                return False
+            if self.minimum is not None and value < self.minimum:
+                return False
+            if self.maximum is not None and value > self.maximum:
+                return False
+        return True
+
+
+class LeafTableModel(QAbstractTableModel):
+    """Table model of one gateway's SolarLEAFs.
+
+    Rows are stored by arrival order and shown through a SortedIndex holding
+    only the rows that pass the filter, so a value change moves a single row
+    instead of re-sorting the table and the view only paints visible rows.
+    """
+
+    STALE_COLOR = QColor(255, 0, 0)
+    ALERT_COLOR = QColor(255, 200, 200)
+
+    def __init__(self, header, columns, timeout, alerting=None, parent=None):
+        super().__init__(parent)
+
+        self.header = header
+        self.columns = columns
+        self.timeout = timeout
+        self.alerting = alerting or (lambda mac: set())
+
+        self.leaves: list = list()
+        self.cells: list[list[str]] = list()
+        self.alerts: list[set] = list()
+        self.rows: dict[str, int] = dict()
+
+        self.sort_column = None
+        self.descending = False
+        self.filter = LeafFilter(timeout)
+        self.order = SortedIndex()
+
+    ### Qt Model Interface ###
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.order)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            if section < len(self.header):
+                return self.header[section]
+            return self.columns[section]
+        if orientation == Qt.Vertical:
+            return str(self.leaf(section).index)
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        row = self.row(index.row())
+        if role == Qt.DisplayRole:
+            return self.cells[row][index.column()]
+        if role == Qt.ForegroundRole:
+            if time.time() - self.leaves[row].last > self.timeout:
+                return QBrush(self.STALE_COLOR)
+        if role == Qt.BackgroundRole:
+            if self.columns[index.column()] in self.alerts[row]:
+                return QBrush(self.ALERT_COLOR)
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column if column >= 0 else None
+        self.descending = order == Qt.DescendingOrder
+        self.rebuild()
+
+    ### Row Mapping ###
+    def row(self, position):
+        # Map a view position to a row id
+        if self.descending:
+            position = len(self.order) - 1 - position
+        return self.order.rows[position]
+
+    def view_position(self, pos):
+        # Map a SortedIndex position to a view position
+        return len(self.order) - 1 - pos if self.descending else pos
+
+    def leaf(self, position):
+        return self.leaves[self.row(position)]
+
+    def key(self, row):
+        if self.sort_column is None:
+            return (0, row)
+        name = self.columns[self.sort_column]
+        leaf = self.leaves[row]
+        if name == "time":
+            return (0, leaf.last)
+        return sort_key(getattr(leaf, name, None), name in TEXT_COLUMNS)
+
+    ### Updates ###
+    def update(self, leaf):
+        row = self.rows.get(leaf.mac)
+        if row is None:
+            row = self.rows[leaf.mac] = len(self.leaves)
+            self.leaves.append(leaf)
+            self.cells.append(list())
+            self.alerts.append(set())
+
+        self.cells[row] = leaf.items()[1:]
+        self.alerts[row] = self.alerting(leaf.mac)
+
+        shown = row in self.order
+        wanted = self.filter(leaf)
+
+        if shown and wanted:
+            self._move(row)
+        elif shown:
+            self._remove(row)
+        elif wanted:
+            self._insert(row)
+
+    def _changed(self, pos):
+        self.dataChanged.emit(
+            self.createIndex(pos, 0),
+            self.createIndex(pos, len(self.columns) - 1),
+        )
+
+    def _move(self, row):
+        # Moving instead of remove + insert keeps the view's selection
+        key = self.key(row)
+        old = self.order.position(row)
+        new = bisect.bisect_left(self.order.keys, (key, row))
+        if new > old:
+            new -= 1
+
+        if new == old:
+            self.order.keys[old] = (key, row)
+            self.order.values[row] = key
+            self._changed(self.view_position(old))
+            return
+
+        source = self.view_position(old)
+        target = self.view_position(new)
+        # Qt expects the destination in positions before the move
+        destination = target + 1 if target > source else target
+
+        self.beginMoveRows(QModelIndex(), source, source, QModelIndex(), destination)
+        self.order.remove(row)
+        self.order.insert(row, key)
+        self.endMoveRows()
+        self._changed(target)
+
+    def _insert(self, row):
+        pos = bisect.bisect_left(self.order.keys, (self.key(row), row))
+        pos = len(self.order) - pos if self.descending else pos
+        self.beginInsertRows(QModelIndex(), pos, pos)
+        self.order.insert(row, self.key(row))
+        self.endInsertRows()
+
+    def _remove(self, row):
+        pos = self.view_position(self.order.position(row))
+        self.beginRemoveRows(QModelIndex(), pos, pos)
+        self.order.remove(row)
+        self.endRemoveRows()
+
+    def remove(self, macs):
+        # Rows are removed one by one instead of a reset to keep the selection
+        rows = {self.rows[mac] for mac in macs if mac in self.rows}
+        for row in rows:
+            if row in self.order:
+                self._remove(row)
+
+        if rows:
+            # Compact the row storage so rows follow the live units only,
+            # compaction keeps the order so the shown rows stay sorted
+            keep = [row for row in range(len(self.leaves)) if row not in rows]
+            renumber = dict((old, new) for new, old in enumerate(keep))
+            self.leaves = [self.leaves[row] for row in keep]
+            self.cells = [self.cells[row] for row in keep]
+            self.alerts = [self.alerts[row] for row in keep]
+            self.rows = dict((leaf.mac, row) for row, leaf in enumerate(self.leaves))
+            self.order.reset(
+                ((0, renumber[row]) if self.sort_column is None else key, renumber[row])
+                for key, row in self.order.keys
+            )
+
+        # Evicting units renumbers the leaf indices shown as row labels
+        if len(self.order):
+            self.headerDataChanged.emit(Qt.Vertical, 0, len(self.order) - 1)
+
+    def rebuild(self):
+        self.beginResetModel()
+        self.order.reset(
+            (self.key(row), row)
+            for row, leaf in enumerate(self.leaves)
+            if self.filter(leaf)
+        )
+        self.endResetModel()
+
+    def refresh(self, first, last):
+        # Units only turn stale with time, so only those rows are inserted
+        if self.filter.stale:
+            for row, leaf in enumerate(self.leaves):
+                if row not in self.order and self.filter(leaf):
+                    self._insert(row)
+
+        # Repaint timeout colors of the visible rows only
+        if len(self.order) and first <= last:
+            self.dataChanged.emit(
+                self.createIndex(first, 0),
+                self.createIndex(last, len(self.columns) - 1),
+                [Qt.ForegroundRole],
+            )
+
+
+class LeafTable(QWidget):
+    """Filter bar and sortable table view of one gateway."""
+
+    RANGE_PLACEHOLDER = "Range Column"
+
+    def __init__(self, header, columns, timeout, font, alerting=None, parent=None):
+        super().__init__(parent)
+
+        self.columns = columns
+        self.model = LeafTableModel(header, columns, timeout, alerting)
+
+        self.view = QTableView()
+        self.view.setModel(self.model)
+        self.view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.view.setSortingEnabled(True)
+        self.view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.view.setFont(font)
+        self.view.setShowGrid(False)
+        self.view.verticalHeader().setDefaultSectionSize(font.pointSize() * 2 + 4)
+
+        style = "background-color: rgb(200, 200, 200); border: none;"
+        self.view.setStyleSheet(f"QHeaderView::section { {style}}")
+        header_font = self.view.horizontalHeader().font()
+        header_font.setFamily(font.family())
+        header_font.setPointSize(font.pointSize())
+        header_font.setBold(True)
+        self.view.horizontalHeader().setFont(header_font)
+
+        # Filter Bar
+        self.mac = QLineEdit(placeholderText="MAC contains")
+        self.version = QLineEdit(placeholderText="Version equals")
+        self.stale = QCheckBox("Stale only")
+        self.column = QComboBox()
+        self.column.addItem(self.RANGE_PLACEHOLDER)
+        self.column.addItems(columns[3:])
+        self.minimum = QLineEdit(placeholderText="Min")
+        self.maximum = QLineEdit(placeholderText="Max")
+
+        for widget in (self.mac, self.version, self.minimum, self.maximum):
+            widget.textChanged.connect(self.apply_filter)
+        self.stale.stateChanged.connect(self.apply_filter)
+        self.column.currentIndexChanged.connect(self.apply_filter)
+
+        bar = QHBoxLayout()
+        for widget in (self.mac, self.version, self.stale):
+            bar.addWidget(widget)
+        for widget in (self.column, self.minimum, self.maximum):
+            bar.addWidget(widget)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(bar)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+
+    def apply_filter(self):
+        f = self.model.filter
+        f.mac = self.mac.text().strip()
+        f.version = self.version.text().strip()
+        f.stale = self.stale.isChecked()
+
+        column = self.column.currentText()
+        f.column = None if column == self.RANGE_PLACEHOLDER else column
+        f.minimum = self._number(self.minimum.text())
+        f.maximum = self._number(self.maximum.text())
+
+        self.model.rebuild()
+
+    def _number(self, text):
+        try:
+            return float(text)
+        except ValueError:
+            return None
+
+    def update_leaf(self, leaf):
+        first = self.model.rowCount() == 0
+        self.model.update(leaf)
+        if first:
+            self.view.resizeColumnsToContents()
+
+    def remove_leaves(self, macs):
+        self.model.remove(macs)
+
+    def refresh(self):
+        # Only the rows currently on screen are repainted and measured
+        first = max(self.view.rowAt(0), 0)
+        last = self.view.rowAt(self.view.viewport().height() - 1)
+        if last < 0:
+            last = self.model.rowCount() - 1
+        self.model.refresh(first, last)
+        self.view.resizeColumnsToContents()
+
+    def selected(self):
+        rows = sorted({index.row() for index in self.view.selectedIndexes()})
+        return [self.model.leaf(row) for row in rows]
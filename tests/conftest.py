@@ -0,0 +1,6 @@
+import sys
+
+from pathlib import Path
+
+# The app modules import each other by bare name from the mqtt-app directory
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "mqtt-app"))
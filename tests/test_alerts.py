@@ -0,0 +1,60 @@
+import time
+
+from types import SimpleNamespace
+
+from alerts import AlertEngine, AlertRule
+
+
+def leaf(mac, **fields):
+    return SimpleNamespace(mac=mac, last=time.time(), **fields)
+
+
+def engine(*rules):
+    return AlertEngine(list(rules), debounce=1, cooldown=0)
+
+
+def test_threshold_fires_after_debounce():
+    alerts = AlertEngine([AlertRule("FET_T", op=">", value=85)], debounce=2, cooldown=0)
+    batch = [leaf("a", FET_T=90), leaf("b", FET_T=20)]
+
+    assert alerts.evaluate("gw", batch) == []
+    assert alerts.evaluate("gw", batch) == [("gw", "a", "FET_T > 85")]
+    assert alerts.alerting("a") == {"FET_T"}
+    assert alerts.alerting("b") == set()
+
+
+def test_change_fires_on_the_changed_unit_only():
+    alerts = engine(AlertRule("sl_status", kind="change"))
+    alerts.evaluate("gw", [leaf("a", sl_status=3), leaf("b", sl_status=1)])
+
+    fired = alerts.evaluate("gw", [leaf("a", sl_status=3), leaf("b", sl_status=2)])
+    assert fired == [("gw", "b", "sl_status changed")]
+
+
+def test_change_ignores_mixed_types_in_a_batch():
+    # A new unit's default "" must not turn the other values into strings
+    alerts = engine(AlertRule("sl_status", kind="change"))
+    alerts.evaluate("gw", [leaf("a", sl_status=3), leaf("b", sl_status="")])
+
+    assert alerts.evaluate("gw", [leaf("a", sl_status=3)]) == []
+    assert alerts.evaluate("gw", [leaf("b", sl_status=0), leaf("a", sl_status=3)]) == [
+        ("gw", "b", "sl_status changed")
+    ]
+
+
+def test_peer_excludes_the_unit_itself():
+    alerts = engine(AlertRule("P_PV", kind="peer", value=0, peer_value=1))
+    idle, producing = leaf("a", P_PV=0), leaf("b", P_PV=50)
+
+    assert alerts.evaluate("gw", [idle], [idle]) == []
+    assert alerts.evaluate("gw", [idle], [idle, producing]) == [
+        ("gw", "a", "P_PV <= 0 while peers produce")
+    ]
+
+
+def test_forget_drops_unit_state():
+    alerts = engine(AlertRule("FET_T", op=">", value=85))
+    alerts.evaluate("gw", [leaf("a", FET_T=90)])
+
+    alerts.forget(["a"])
+    assert alerts.alerting("a") == set()